@@ -20,6 +20,12 @@ os.makedirs('data', exist_ok=True)
 # Set page config for wide layout
 st.set_page_config(page_title="YourCarbonFootprint", page_icon="🌍", layout="wide")
 
+# Build the RAG system when the app first loads rather than on the first
+# AI Insights visit (rag_system builds it on import when the flag is set)
+if os.getenv("RAG_EAGER_INIT") == "1":
+    with st.spinner("Initializing RAG knowledge base..."):
+        import rag_system  # noqa: F401
+
 # Initialize session state variables if they don't exist
 if 'language' not in st.session_state:
     st.session_state.language = 'English'
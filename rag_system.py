@@ -3,46 +3,492 @@ RAG (Retrieval-Augmented Generation) System for Carbon Footprint Application.
 Provides document retrieval and context augmentation for AI agents.
 """
 
+import glob
+import hashlib
 import os
-from typing import List, Dict, Any
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional
+import faiss
+import numpy as np
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain.chains import RetrievalQA
-from langchain.prompts import PromptTemplate
-from langchain.schema import Document
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+# Heavy dependencies (torch, langchain_groq, sentence-transformers, the
+# text splitter) are imported where they are first used to keep
+# `import rag_system` cheap on Streamlit reruns.
 
 # Load environment variables
 load_dotenv()
 
+_torch_configured = False
+
+
+def _configure_torch():
+    """
+    Tune torch for inference before the first model is loaded.
+    
+    Inference-only process: use every core for intra-op parallelism.
+    Gradient tracking is switched off per forward pass with
+    torch.inference_mode(), since set_grad_enabled only affects the
+    calling thread.
+    """
+    global _torch_configured
+    if _torch_configured:
+        return
+    
+    import torch
+    
+    torch.set_num_threads(os.cpu_count() or 1)
+    torch.set_float32_matmul_precision("high")
+    try:
+        torch.set_num_interop_threads(2)
+    except RuntimeError:
+        # Only settable once, before any inter-op parallel work has started
+        pass
+    _torch_configured = True
+
+
+# Embedding model settings. The int8 ONNX export is built once and cached
+# outside the knowledge base so its tokenizer files are not indexed.
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_MAX_SEQ_LENGTH = 256
+EMBEDDING_BATCH_SIZE = 64
+
+# SQLite caps the number of bound parameters per statement
+EMBEDDING_CACHE_QUERY_SIZE = 500
+ONNX_MODEL_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "yourcarbonfootprint", "all-MiniLM-L6-v2-onnx-int8"
+)
+
+# FAISS index settings. Embeddings are unit-normalized, so inner product
+# ranks like cosine similarity. Corpora that fit in RAM use an exhaustive
+# int8 scalar-quantized index; larger ones switch to IVF-PQ.
+IVF_PQ_FACTORY = "IVF64,PQ48"
+IVF_PQ_MIN_CORPUS_SIZE = 200_000
+IVF_NPROBE = 8
+
+# add_documents appends delta files next to the base index; once more than
+# this many are pending they are compacted into a full save.
+MAX_PENDING_DELTAS = 32
+
+# Below this many chunks a NumPy matrix product beats FAISS's wrapper
+# overhead, so retrieval searches an in-memory embedding matrix instead.
+NUMPY_SEARCH_MAX_SIZE = 2000
+
+# Concurrent retrieve_context calls arriving within this window share one
+# embedding pass and one FAISS search.
+BATCH_WINDOW_SECONDS = 0.005
+
+# A question whose embedding has at least this cosine similarity with a
+# cached question reuses the cached answer.
+CACHE_SIMILARITY_THRESHOLD = 0.95
+CACHE_MAX_ENTRIES = 256
+
+# Cross-encoder reranking: fetch this many FAISS candidates per query and
+# rescore them before truncating to k.
+RERANKER_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_FETCH_K = 50
+RERANK_BATCH_SIZE = 32
+
+# Knowledge base files are read concurrently to overlap disk I/O
+LOADER_MAX_WORKERS = 8
+
+# Chunking settings; part of the split cache signature
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+
+def _read_text_file(path: str) -> str:
+    """Read a UTF-8 text file."""
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+class _QueryBatcher:
+    """Coalesces concurrent single-query retrievals into one batched search."""
+    
+    def __init__(self, search_fn, window: float = BATCH_WINDOW_SECONDS):
+        """
+        Args:
+            search_fn: Callable taking (queries, k, rerank) and returning one document list per query
+            window: Seconds to wait for other queries before running the batch
+        """
+        self._search_fn = search_fn
+        self._window = window
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flush_scheduled = False
+    
+    def submit(self, query: str, k: int, rerank: bool = True) -> Future:
+        """
+        Queue a query for the next batch.
+        
+        The first caller of a window waits for it to close and runs the batch
+        on its own thread; later callers just wait on their future.
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((query, k, rerank, future))
+            is_leader = not self._flush_scheduled
+            self._flush_scheduled = True
+        
+        if is_leader:
+            time.sleep(self._window)
+            self._flush()
+        return future
+    
+    def _flush(self):
+        """Run every pending query in a single batched search."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            self._flush_scheduled = False
+        
+        for rerank in (True, False):
+            group = [item for item in batch if item[2] == rerank]
+            if group:
+                self._run(group, rerank)
+    
+    def _run(self, group: list, rerank: bool):
+        """Search one group of queries sharing the same rerank setting."""
+        queries = [query for query, _, _, _ in group]
+        max_k = max(k for _, k, _, _ in group)
+        try:
+            results = self._search_fn(queries, max_k, rerank)
+        except Exception as e:
+            for _, _, _, future in group:
+                future.set_exception(e)
+            return
+        
+        # Results are ordered best-first, so a larger k is a superset
+        for (_, k, _, future), docs in zip(group, results):
+            future.set_result(docs[:k])
+
+
+def _pad_token_ids(tokenizer, token_ids: List[List[int]]) -> Dict[str, np.ndarray]:
+    """
+    Build padded model inputs from token IDs tokenized without special tokens.
+    
+    Args:
+        tokenizer: Tokenizer that produced the IDs
+        token_ids: One list of token IDs per text
+        
+    Returns:
+        input_ids, attention_mask and token_type_ids arrays
+    """
+    # BERT layout, built by hand: transformers 5 tokenizers no longer
+    # provide build_inputs_with_special_tokens
+    sequences = [
+        [tokenizer.cls_token_id] + ids[:EMBEDDING_MAX_SEQ_LENGTH - 2] + [tokenizer.sep_token_id]
+        for ids in token_ids
+    ]
+    input_ids = np.full(
+        (len(sequences), max(len(ids) for ids in sequences)),
+        tokenizer.pad_token_id,
+        dtype=np.int64
+    )
+    attention_mask = np.zeros_like(input_ids)
+    for row, ids in enumerate(sequences):
+        input_ids[row, :len(ids)] = ids
+        attention_mask[row, :len(ids)] = 1
+    return {
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "token_type_ids": np.zeros_like(input_ids)
+    }
+
+
+class ONNXMiniLMEmbeddings(Embeddings):
+    """MiniLM sentence embeddings served by ONNX Runtime with int8 weights."""
+    
+    QUANTIZED_FILE_NAME = "model_quantized.onnx"
+    
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR,
+                 model_name: str = EMBEDDING_MODEL_NAME, batch_size: int = EMBEDDING_BATCH_SIZE):
+        """
+        Load the quantized model, exporting and quantizing it on first use.
+        
+        Args:
+            model_dir: Directory holding the exported ONNX model and tokenizer
+            model_name: HuggingFace model to export
+            batch_size: Number of texts per ONNX Runtime call
+        """
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+        
+        if not os.path.exists(os.path.join(model_dir, self.QUANTIZED_FILE_NAME)):
+            model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            model.save_pretrained(model_dir)
+            AutoTokenizer.from_pretrained(model_name, use_fast=True).save_pretrained(model_dir)
+            
+            # Dynamic quantization: int8 weights, activations quantized per batch
+            quantizer = ORTQuantizer.from_pretrained(model)
+            quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=model_dir, quantization_config=quantization_config)
+        
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, file_name=self.QUANTIZED_FILE_NAME
+        )
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts into L2-normalized vectors."""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=EMBEDDING_MAX_SEQ_LENGTH,
+                return_tensors="np"
+            )
+            vectors.append(self._encode(inputs))
+        return np.concatenate(vectors).tolist() if vectors else []
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query text."""
+        return self.embed_documents([text])[0]
+    
+    def embed_token_ids(self, token_ids: List[List[int]]) -> List[List[float]]:
+        """
+        Embed texts that were already tokenized without special tokens.
+        
+        Args:
+            token_ids: One list of token IDs per text, as produced by self.tokenizer
+            
+        Returns:
+            L2-normalized vectors, one per text
+        """
+        vectors = []
+        for start in range(0, len(token_ids), self.batch_size):
+            inputs = _pad_token_ids(self.tokenizer, token_ids[start:start + self.batch_size])
+            vectors.append(self._encode(inputs))
+        return np.concatenate(vectors).tolist() if vectors else []
+    
+    def _encode(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        """Run the ONNX model and mean-pool token embeddings over the attention mask."""
+        token_embeddings = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """MiniLM sentence embeddings from SentenceTransformer, in bfloat16 where the CPU supports it."""
+    
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME,
+                 batch_size: int = EMBEDDING_BATCH_SIZE):
+        """
+        Args:
+            model_name: SentenceTransformer model to load
+            batch_size: Number of texts per forward pass
+        """
+        from sentence_transformers import SentenceTransformer
+        
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.model.max_seq_length = EMBEDDING_MAX_SEQ_LENGTH
+        self.tokenizer = self.model.tokenizer
+        self.batch_size = batch_size
+        self.use_bf16 = self._cpu_supports_bf16()
+        # Normalization runs separately in FP32, after the reduced-precision forward
+        self._modules = [
+            module for module in self.model if type(module).__name__ != "Normalize"
+        ]
+    
+    @staticmethod
+    def _cpu_supports_bf16() -> bool:
+        """
+        Check whether this CPU has native bfloat16 instructions.
+        
+        oneDNN also accepts bfloat16 on plain AVX-512 CPUs, but emulates it
+        there more slowly than FP32, so only AVX512_BF16 or AMX counts.
+        """
+        import torch
+        
+        try:
+            return bool(torch.cpu._is_avx512_bf16_supported() or torch.cpu._is_amx_tile_supported())
+        except Exception:
+            return False
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts into L2-normalized vectors."""
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            features = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True,
+                truncation=True,
+                max_length=EMBEDDING_MAX_SEQ_LENGTH,
+                return_tensors="np"
+            )
+            vectors.append(self._encode(features))
+        return np.concatenate(vectors).tolist() if vectors else []
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a single query text."""
+        return self.embed_documents([text])[0]
+    
+    def embed_token_ids(self, token_ids: List[List[int]]) -> List[List[float]]:
+        """
+        Embed texts that were already tokenized without special tokens.
+        
+        Args:
+            token_ids: One list of token IDs per text, as produced by self.tokenizer
+            
+        Returns:
+            L2-normalized vectors, one per text
+        """
+        vectors = []
+        for start in range(0, len(token_ids), self.batch_size):
+            features = _pad_token_ids(self.tokenizer, token_ids[start:start + self.batch_size])
+            vectors.append(self._encode(features))
+        return np.concatenate(vectors).tolist() if vectors else []
+    
+    def _encode(self, features: Dict[str, np.ndarray]) -> np.ndarray:
+        """Run the transformer and pooling modules, then L2-normalize in FP32."""
+        import torch
+        
+        features = {name: torch.as_tensor(value) for name, value in features.items()}
+        with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16, enabled=self.use_bf16):
+            for module in self._modules:
+                features = module(features)
+        embeddings = features["sentence_embedding"].float()
+        return torch.nn.functional.normalize(embeddings, dim=1).numpy()
+
+
+class SemanticResponseCache:
+    """LRU cache of query results keyed by question embedding similarity."""
+    
+    def __init__(self, threshold: float = CACHE_SIMILARITY_THRESHOLD,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        """
+        Args:
+            threshold: Minimum cosine similarity for a cache hit
+            max_entries: Number of answers kept before evicting the least recently used
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.clear()
+    
+    def clear(self):
+        """Drop all cached answers."""
+        with self._lock:
+            self._index = None
+            self._entries = []
+            self._last_used = []
+    
+    def lookup(self, vector: np.ndarray) -> Optional[Dict[str, Any]]:
+        """
+        Find a cached answer for a similar question.
+        
+        Args:
+            vector: Question embedding of shape (1, dim), normalized in place
+            
+        Returns:
+            The cached result dictionary, or None on a miss
+        """
+        faiss.normalize_L2(vector)
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0:
+                return None
+            scores, indices = self._index.search(vector, 1)
+            position = int(indices[0][0])
+            if position == -1 or scores[0][0] < self.threshold:
+                return None
+            self._last_used[position] = time.monotonic()
+            return self._entries[position]
+    
+    def add(self, vector: np.ndarray, result: Dict[str, Any]):
+        """
+        Cache the result for a question.
+        
+        Args:
+            vector: Question embedding of shape (1, dim), normalized in place
+            result: Result dictionary to return for similar questions
+        """
+        faiss.normalize_L2(vector)
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexFlatIP(vector.shape[1])
+            self._index.add(vector)
+            self._entries.append(result)
+            self._last_used.append(time.monotonic())
+            
+            if len(self._entries) > self.max_entries:
+                # IndexFlat compacts on removal, keeping positions aligned with the lists
+                oldest = int(np.argmin(self._last_used))
+                self._index.remove_ids(np.array([oldest], dtype=np.int64))
+                del self._entries[oldest]
+                del self._last_used[oldest]
+
 
 class CarbonFootprintRAG:
     """RAG system for carbon accounting knowledge base."""
     
-    def __init__(self, knowledge_base_path: str = "knowledge_base"):
+    def __init__(self, knowledge_base_path: str = "knowledge_base", use_reranker: bool = True):
         """
         Initialize the RAG system.
         
         Args:
             knowledge_base_path: Path to the directory containing knowledge base documents
+            use_reranker: Whether to rerank retrieved documents with a cross-encoder
         """
         self.knowledge_base_path = knowledge_base_path
+        self.use_reranker = use_reranker
         self.vector_store = None
         self.llm = None
-        self.qa_chain = None
+        self.reranker = None
+        self._batcher = _QueryBatcher(self.retrieve_context_batch)
+        self.response_cache = SemanticResponseCache()
+        # Runs the question embedding while query_stream prepares the vector store
+        self._executor = ThreadPoolExecutor(max_workers=2)
+        # Read-only memory map of the document embeddings, row i = FAISS id i
+        self._emb_mm = None
+        # Rows added since the memory map was written, in FAISS id order
+        self._emb_deltas: List[np.ndarray] = []
+        # In-RAM copy of the embeddings for NumPy search on tiny corpora
+        self._emb_matrix = None
         
         # Create knowledge base directory if it doesn't exist
         os.makedirs(knowledge_base_path, exist_ok=True)
         
+        # Chunk embeddings keyed by content hash, so rebuilds only embed new chunks
+        self._emb_cache = sqlite3.connect(
+            os.path.join(knowledge_base_path, ".emb_cache.sqlite"),
+            check_same_thread=False
+        )
+        self._emb_cache.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, vec BLOB)"
+        )
+        self._emb_cache_lock = threading.Lock()
+        
         # Initialize components
         self._initialize_llm()
         self._initialize_embeddings()
+        self._initialize_reranker()
+        
+        # Agent context is budgeted in embedding-model tokens, the unit of the
+        # token IDs stored on each chunk. This is the cost of the
+        # "[Source N]: " header and separators around each chunk.
+        self._source_header_tokens = self._count_tokens("[Source 10]: \n\n")
         
     def _initialize_llm(self):
         """Initialize the Groq LLM."""
+        from langchain_groq import ChatGroq
+        
         self.llm = ChatGroq(
             model="llama-3.3-70b-versatile",
             temperature=0.3,
@@ -50,43 +496,136 @@ class CarbonFootprintRAG:
         )
     
     def _initialize_embeddings(self):
-        """Initialize the embedding model."""
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        """
+        Initialize the embedding model.
+        
+        Uses the int8 ONNX Runtime export of MiniLM when optimum is installed,
+        falling back to the SentenceTransformer model otherwise.
+        """
+        try:
+            _configure_torch()
+        except ImportError:
+            pass
+        
+        try:
+            self.embeddings = ONNXMiniLMEmbeddings()
+        except Exception as e:
+            print(f"ONNX embeddings unavailable, using PyTorch model: {str(e)}")
+            self.embeddings = SentenceTransformerEmbeddings()
+        
+        # Cached embeddings are only valid for the backend, model and truncation
+        # length that produced them; blake2b keys are limited to 64 bytes
+        backend = "|".join([
+            type(self.embeddings).__name__,
+            getattr(self.embeddings, "model_name", EMBEDDING_MODEL_NAME),
+            str(EMBEDDING_MAX_SEQ_LENGTH),
+        ])
+        self._embedding_hash_key = hashlib.blake2b(backend.encode("utf-8")).digest()
+        
+        # Pay tokenizer and kernel warm-up here rather than on the first user query
+        try:
+            for _ in range(2):
+                self.embeddings.embed_query("warmup")
+        except Exception as e:
+            print(f"Embedding warm-up failed: {str(e)}")
+    
+    def _initialize_reranker(self):
+        """Initialize the cross-encoder used to rerank retrieved documents."""
+        if not self.use_reranker:
+            return
+        
+        try:
+            from sentence_transformers import CrossEncoder
+            self.reranker = CrossEncoder(RERANKER_MODEL_NAME, device="cpu")
+        except Exception as e:
+            print(f"Reranker unavailable, using FAISS ranking only: {str(e)}")
+            self.reranker = None
+    
+    def _count_tokens(self, text: str) -> int:
+        """Count embedding-model tokens in text."""
+        return len(self.embeddings.tokenizer(text, add_special_tokens=False)["input_ids"])
     
     def load_documents(self) -> List[Document]:
         """
         Load documents from the knowledge base directory.
         
+        Split chunks are cached on disk and reused while no knowledge base
+        file has been added, removed or modified.
+        
         Returns:
             List of Document objects
         """
         try:
+            paths = sorted(glob.glob(
+                os.path.join(self.knowledge_base_path, "**", "*.txt"),
+                recursive=True
+            ))
+            signature = self._split_cache_signature(paths)
+            cached_splits = self._load_split_cache(signature)
+            if cached_splits is not None:
+                return cached_splits
+            
             # Load text files from knowledge base
-            loader = DirectoryLoader(
-                self.knowledge_base_path,
-                glob="**/*.txt",
-                loader_cls=TextLoader,
-                loader_kwargs={'encoding': 'utf-8'}
-            )
-            documents = loader.load()
+            with ThreadPoolExecutor(max_workers=LOADER_MAX_WORKERS) as executor:
+                texts = list(executor.map(_read_text_file, paths))
+            documents = [
+                Document(page_content=text, metadata={"source": path})
+                for path, text in zip(paths, texts)
+            ]
             
             # Split documents into chunks
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
             text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=1000,
-                chunk_overlap=200,
+                chunk_size=CHUNK_SIZE,
+                chunk_overlap=CHUNK_OVERLAP,
                 length_function=len
             )
             splits = text_splitter.split_documents(documents)
+            self._attach_token_ids(splits)
             
+            self._save_split_cache(signature, splits)
             return splits
         except Exception as e:
             print(f"Error loading documents: {str(e)}")
             return []
     
+    def _split_cache_path(self) -> str:
+        """Path of the cached document splits."""
+        return os.path.join(self.knowledge_base_path, ".splits_cache.pkl")
+    
+    def _split_cache_signature(self, paths: List[str]) -> list:
+        """Identify the knowledge base state by file paths, mtimes and sizes."""
+        signature = [CHUNK_SIZE, CHUNK_OVERLAP]
+        for path in paths:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        return signature
+    
+    def _load_split_cache(self, signature: list) -> Optional[List[Document]]:
+        """Return the cached splits if they were built from the same files."""
+        cache_path = self._split_cache_path()
+        if not os.path.exists(cache_path):
+            return None
+        
+        try:
+            with open(cache_path, "rb") as f:
+                cached_signature, splits = pickle.load(f)
+        except Exception as e:
+            print(f"Ignoring unreadable split cache: {str(e)}")
+            return None
+        return splits if cached_signature == signature else None
+    
+    def _save_split_cache(self, signature: list, splits: List[Document]):
+        """Write the splits and the signature they were built from."""
+        cache_path = self._split_cache_path()
+        tmp_path = cache_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((signature, splits), f)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Could not write split cache: {str(e)}")
+    
     def create_vector_store(self, documents: List[Document] = None):
         """
         Create or update the FAISS vector store.
@@ -101,20 +640,154 @@ class CarbonFootprintRAG:
             print("No documents found to create vector store.")
             return
         
-        # Create FAISS vector store
-        self.vector_store = FAISS.from_documents(
-            documents=documents,
-            embedding=self.embeddings
-        )
+        # Embed all chunks and build the FAISS vector store over them
+        embeddings = self._encode_smart_batched(documents)
+        self.vector_store = self._build_vector_store(documents, embeddings)
+        self.response_cache.clear()
         
-        # Save vector store to disk
-        vector_store_path = os.path.join(self.knowledge_base_path, "faiss_index")
-        self.vector_store.save_local(vector_store_path)
+        # Save vector store and embedding matrix to disk
+        self.vector_store.save_local(self._vector_store_path())
+        self._save_embedding_matrix(embeddings)
+        self._remove_deltas()
         print(f"Vector store created with {len(documents)} document chunks.")
     
+    def _encode_smart_batched(self, documents: List[Document]) -> np.ndarray:
+        """
+        Embed documents in batches of similar token length.
+        
+        Chunks already in the embedding cache are not re-embedded. The rest
+        are sorted by length before batching to keep per-batch padding
+        small. Rows are returned L2-normalized in the original document order.
+        
+        Args:
+            documents: Documents to embed
+            
+        Returns:
+            FP32 matrix with one embedding row per document
+        """
+        texts = [doc.page_content for doc in documents]
+        self._attach_token_ids(documents)
+        hashes = [self._embedding_hash(text) for text in texts]
+        vectors_by_hash = self._get_cached_embeddings(hashes)
+        missing = [i for i, digest in enumerate(hashes) if digest not in vectors_by_hash]
+        
+        if missing:
+            token_ids = {i: documents[i].metadata["token_ids"] for i in missing}
+            lengths = [len(token_ids[i]) for i in missing]
+            
+            order = [missing[i] for i in np.argsort(lengths, kind="stable")]
+            new_vectors = {}
+            for start in range(0, len(order), EMBEDDING_BATCH_SIZE):
+                batch_order = order[start:start + EMBEDDING_BATCH_SIZE]
+                # Reuse the stored token IDs instead of re-tokenizing the text
+                vectors = self.embeddings.embed_token_ids([token_ids[i] for i in batch_order])
+                for i, vector in zip(batch_order, np.asarray(vectors, dtype=np.float32)):
+                    new_vectors[hashes[i]] = vector
+            
+            self._store_cached_embeddings(new_vectors)
+            vectors_by_hash.update(new_vectors)
+        
+        # Assemble rows in the original document order
+        embeddings = np.stack([vectors_by_hash[digest] for digest in hashes])
+        faiss.normalize_L2(embeddings)
+        return embeddings
+    
+    def _embedding_hash(self, text: str) -> bytes:
+        """Key a chunk's embedding by its content and the embedding model."""
+        return hashlib.blake2b(
+            text.encode("utf-8"), digest_size=16, key=self._embedding_hash_key
+        ).digest()
+    
+    def _get_cached_embeddings(self, hashes: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Look up cached embeddings for the given content hashes."""
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        with self._emb_cache_lock:
+            for start in range(0, len(unique_hashes), EMBEDDING_CACHE_QUERY_SIZE):
+                chunk = unique_hashes[start:start + EMBEDDING_CACHE_QUERY_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._emb_cache.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE hash IN ({placeholders})", chunk
+                )
+                for digest, vec in rows:
+                    found[digest] = np.frombuffer(vec, dtype=np.float32)
+        return found
+    
+    def _store_cached_embeddings(self, vectors_by_hash: Dict[bytes, np.ndarray]):
+        """Add newly computed embeddings to the cache."""
+        with self._emb_cache_lock, self._emb_cache:
+            self._emb_cache.executemany(
+                "INSERT OR IGNORE INTO embeddings (hash, vec) VALUES (?, ?)",
+                [(digest, vector.tobytes()) for digest, vector in vectors_by_hash.items()]
+            )
+    
+    def _attach_token_ids(self, documents: List[Document]):
+        """
+        Store each document's embedding-model token IDs in its metadata.
+        
+        Documents that already carry "token_ids" are left as they are; the
+        rest are tokenized in a single batched call.
+        """
+        missing = [doc for doc in documents if "token_ids" not in doc.metadata]
+        if not missing:
+            return
+        
+        encoded = self.embeddings.tokenizer(
+            [doc.page_content for doc in missing], add_special_tokens=False
+        )
+        for doc, ids in zip(missing, encoded["input_ids"]):
+            doc.metadata["token_ids"] = ids
+    
+    def _build_vector_store(self, documents: List[Document], embeddings: np.ndarray) -> FAISS:
+        """
+        Build a FAISS vector store from documents and their embeddings.
+        
+        Args:
+            documents: Document chunks to index
+            embeddings: Normalized FP32 matrix with one embedding row per document
+            
+        Returns:
+            LangChain FAISS vector store wrapping the trained index
+        """
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        
+        dim = embeddings.shape[1]
+        if len(documents) >= IVF_PQ_MIN_CORPUS_SIZE:
+            index = faiss.index_factory(dim, IVF_PQ_FACTORY, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexScalarQuantizer(
+                dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+        index.train(embeddings)
+        index.add(embeddings)
+        
+        ids = [str(uuid.uuid4()) for _ in documents]
+        vector_store = FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=InMemoryDocstore(dict(zip(ids, documents))),
+            index_to_docstore_id=dict(enumerate(ids)),
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+        )
+        self._configure_vector_store(vector_store)
+        return vector_store
+    
+    def _configure_vector_store(self, vector_store: FAISS):
+        """Apply query-time settings that are not persisted with the FAISS index."""
+        index = vector_store.index
+        if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            vector_store.distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
+        ivf_index = faiss.try_extract_index_ivf(index)
+        if ivf_index is not None:
+            ivf_index.nprobe = IVF_NPROBE
+    
+    def _vector_store_path(self) -> str:
+        """Directory holding the saved FAISS index and its delta files."""
+        return os.path.join(self.knowledge_base_path, "faiss_index")
+    
     def load_vector_store(self):
-        """Load existing FAISS vector store from disk."""
-        vector_store_path = os.path.join(self.knowledge_base_path, "faiss_index")
+        """Load existing FAISS vector store from disk, merging pending deltas."""
+        vector_store_path = self._vector_store_path()
         
         if os.path.exists(vector_store_path):
             self.vector_store = FAISS.load_local(
@@ -122,6 +795,10 @@ class CarbonFootprintRAG:
                 self.embeddings,
                 allow_dangerous_deserialization=True
             )
+            self._load_embedding_matrix()
+            self._merge_deltas()
+            self._refresh_search_matrix()
+            self._configure_vector_store(self.vector_store)
             print("Vector store loaded successfully.")
         else:
             print("No existing vector store found. Creating new one...")
@@ -131,6 +808,9 @@ class CarbonFootprintRAG:
         """
         Add new documents to the existing vector store.
         
+        Only the new vectors and documents are written to disk, as a delta
+        file; the full index is rewritten once too many deltas are pending.
+        
         Args:
             documents: List of Document objects to add
         """
@@ -138,19 +818,164 @@ class CarbonFootprintRAG:
             self.load_vector_store()
         
         if documents:
-            self.vector_store.add_documents(documents)
-            # Save updated vector store
-            vector_store_path = os.path.join(self.knowledge_base_path, "faiss_index")
-            self.vector_store.save_local(vector_store_path)
+            embeddings = self._encode_smart_batched(documents)
+            ids = self.vector_store.add_embeddings(
+                text_embeddings=zip([doc.page_content for doc in documents], embeddings.tolist()),
+                metadatas=[doc.metadata for doc in documents]
+            )
+            self.response_cache.clear()
+            if self._emb_mm is not None:
+                # Held in memory until the next compaction rewrites the file
+                self._emb_deltas.append(embeddings)
+                self._refresh_search_matrix()
+            
+            self._write_delta(ids, embeddings)
+            if len(self._delta_paths()) > MAX_PENDING_DELTAS:
+                self.compact()
             print(f"Added {len(documents)} documents to vector store.")
     
-    def setup_qa_chain(self):
-        """Set up the RetrievalQA chain."""
+    def compact(self):
+        """
+        Rewrite the saved vector store in full and delete its delta files.
+        
+        The deltas are deleted last; if the process dies before that, the
+        next load recognizes them as already compacted and skips them.
+        """
         if self.vector_store is None:
-            self.load_vector_store()
+            return
+        
+        self.vector_store.save_local(self._vector_store_path())
+        if self._emb_mm is not None:
+            self._save_embedding_matrix(np.concatenate([self._emb_mm, *self._emb_deltas]))
+        self._remove_deltas()
+    
+    def _delta_paths(self) -> List[str]:
+        """Paths of complete delta files, oldest first."""
+        pattern = os.path.join(self._vector_store_path(), "delta_*.pkl")
+        return sorted(
+            glob.glob(pattern),
+            key=lambda path: int(os.path.basename(path)[len("delta_"):-len(".pkl")])
+        )
+    
+    def _write_delta(self, ids: List[str], embeddings: np.ndarray):
+        """
+        Save newly added documents and their FP32 embeddings as a delta file.
+        
+        The file is written under a temporary name and renamed into place,
+        so only complete deltas are ever merged.
+        """
+        delta_path = os.path.join(self._vector_store_path(), f"delta_{time.time_ns()}.pkl")
+        entries = [(doc_id, self.vector_store.docstore.search(doc_id)) for doc_id in ids]
+        with open(delta_path + ".tmp", "wb") as f:
+            pickle.dump((entries, embeddings), f)
+        os.replace(delta_path + ".tmp", delta_path)
+    
+    def _merge_deltas(self):
+        """
+        Merge pending delta files into the loaded base vector store.
+        
+        Deltas whose documents are already in the docstore were saved by an
+        interrupted compaction and are not added a second time.
+        """
+        index = self.vector_store.index
+        docstore = self.vector_store.docstore
+        positions = None
+        delta_rows = []
+        for delta_path in self._delta_paths():
+            with open(delta_path, "rb") as f:
+                entries, embeddings = pickle.load(f)
+            
+            first_id = entries[0][0]
+            if isinstance(docstore.search(first_id), Document):
+                if positions is None:
+                    positions = {
+                        doc_id: i for i, doc_id in self.vector_store.index_to_docstore_id.items()
+                    }
+                delta_rows.append((positions[first_id], embeddings))
+                continue
+            
+            # The base index is already trained, so adding the raw vectors
+            # yields the same codes an incremental add would have stored
+            offset = index.ntotal
+            index.add(embeddings)
+            docstore.add(dict(entries))
+            for i, (doc_id, _) in enumerate(entries):
+                self.vector_store.index_to_docstore_id[offset + i] = doc_id
+            delta_rows.append((offset, embeddings))
+        
+        self._extend_embedding_matrix(delta_rows)
+    
+    def _extend_embedding_matrix(self, delta_rows: list):
+        """
+        Append the delta rows missing from the saved embedding matrix.
+        
+        Args:
+            delta_rows: (FAISS id of the first row, embeddings) per delta file
+        """
+        if self._emb_mm is None:
+            return
+        
+        num_rows = len(self._emb_mm)
+        for offset, embeddings in delta_rows:
+            if offset + len(embeddings) <= num_rows:
+                continue
+            if offset != num_rows:
+                break
+            self._emb_deltas.append(embeddings)
+            num_rows += len(embeddings)
+        
+        if num_rows != self.vector_store.index.ntotal:
+            print("Saved embedding matrix does not match the vector store; ignoring it.")
+            self._emb_mm = None
+            self._emb_deltas = []
+    
+    def _remove_deltas(self):
+        """Delete all delta files of the saved vector store, complete or not."""
+        for path in glob.glob(os.path.join(self._vector_store_path(), "delta_*")):
+            os.remove(path)
+    
+    def _embedding_matrix_path(self) -> str:
+        """Path of the saved document embedding matrix."""
+        return os.path.join(self.knowledge_base_path, "embeddings.npy")
+    
+    def _save_embedding_matrix(self, embeddings: np.ndarray):
+        """
+        Save the document embedding matrix and re-open it memory-mapped.
         
-        # Create custom prompt template
-        prompt_template = """You are an expert in carbon accounting, emissions tracking, and environmental regulations.
+        The file is written under a temporary name and swapped in, so an
+        existing memory map of the previous file stays valid.
+        """
+        path = self._embedding_matrix_path()
+        tmp_path = path + ".tmp.npy"
+        np.save(tmp_path, np.asarray(embeddings, dtype=np.float32))
+        os.replace(tmp_path, path)
+        self._emb_mm = np.load(path, mmap_mode="r")
+        self._emb_deltas = []
+        self._refresh_search_matrix()
+    
+    def _refresh_search_matrix(self):
+        """Copy the embeddings into RAM for NumPy search if the corpus is tiny."""
+        if self._emb_mm is None:
+            self._emb_matrix = None
+            return
+        
+        num_rows = len(self._emb_mm) + sum(len(rows) for rows in self._emb_deltas)
+        if num_rows < NUMPY_SEARCH_MAX_SIZE:
+            self._emb_matrix = np.concatenate([self._emb_mm, *self._emb_deltas]).astype(np.float32)
+        else:
+            self._emb_matrix = None
+    
+    def _load_embedding_matrix(self):
+        """Memory-map the saved embedding matrix, if there is one."""
+        path = self._embedding_matrix_path()
+        self._emb_mm = None
+        self._emb_deltas = []
+        if os.path.exists(path):
+            self._emb_mm = np.load(path, mmap_mode="r")
+    
+    def _build_prompt(self, context: str, question: str) -> str:
+        """Format the question-answering prompt for the LLM."""
+        return f"""You are an expert in carbon accounting, emissions tracking, and environmental regulations.
 Use the following pieces of context to answer the question at the end. 
 If you don't know the answer based on the context, just say that you don't know, don't try to make up an answer.
 Always cite the relevant regulations or standards when applicable.
@@ -160,42 +985,26 @@ Context: {context}
 Question: {question}
 
 Answer: """
-        
-        PROMPT = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question"]
-        )
-        
-        # Create RetrievalQA chain
-        self.qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 4}
-            ),
-            return_source_documents=True,
-            chain_type_kwargs={"prompt": PROMPT}
-        )
     
     def query(self, question: str) -> Dict[str, Any]:
         """
         Query the RAG system with a question.
         
+        Answers to semantically similar earlier questions are served from
+        the response cache without retrieval or an LLM call.
+        
         Args:
             question: The question to ask
             
         Returns:
             Dictionary containing the answer and source documents
         """
-        if self.qa_chain is None:
-            self.setup_qa_chain()
-        
         try:
-            result = self.qa_chain.invoke({"query": question})
+            source_documents = []
+            answer = "".join(self._stream_answer(question, source_documents))
             return {
-                "answer": result["result"],
-                "source_documents": result["source_documents"]
+                "answer": answer,
+                "source_documents": source_documents
             }
         except Exception as e:
             return {
@@ -203,34 +1012,171 @@ Answer: """
                 "source_documents": []
             }
     
-    def retrieve_context(self, query: str, k: int = 4) -> List[Document]:
+    def query_stream(self, question: str) -> Iterator[str]:
+        """
+        Query the RAG system and stream the answer as the LLM generates it.
+        
+        Args:
+            question: The question to ask
+            
+        Yields:
+            Successive pieces of the answer text
+        """
+        yield from self._stream_answer(question, [])
+    
+    def _stream_answer(self, question: str, source_documents: List[Document]) -> Iterator[str]:
+        """
+        Answer a question from the cache or by streaming the LLM.
+        
+        Args:
+            question: The question to ask
+            source_documents: List that receives the documents the answer is based on
+            
+        Yields:
+            Successive pieces of the answer text
+        """
+        if self.vector_store is None:
+            # Embed the question while the vector store is loaded
+            question_future = self._executor.submit(self.embeddings.embed_query, question)
+            self.load_vector_store()
+            question_embedding = question_future.result()
+        else:
+            question_embedding = self.embeddings.embed_query(question)
+        question_vector = np.asarray([question_embedding], dtype=np.float32)
+        
+        cached = self.response_cache.lookup(question_vector)
+        if cached is not None:
+            source_documents.extend(cached["source_documents"])
+            yield cached["answer"]
+            return
+        
+        docs = self.retrieve_context_batch([question], k=4, query_vectors=question_vector)[0]
+        source_documents.extend(docs)
+        context = "\n\n".join(doc.page_content for doc in docs)
+        
+        answer_parts = []
+        for chunk in self.llm.stream(self._build_prompt(context, question)):
+            answer_parts.append(chunk.content)
+            yield chunk.content
+        
+        # Only complete answers are cached
+        self.response_cache.add(question_vector, {
+            "answer": "".join(answer_parts),
+            "source_documents": docs
+        })
+    
+    def retrieve_context(self, query: str, k: int = 4, rerank: bool = True) -> List[Document]:
         """
         Retrieve relevant documents for a given query.
         
+        Concurrent calls are coalesced into a single batched search.
+        
         Args:
             query: The search query
             k: Number of documents to retrieve
+            rerank: Whether to rerank FAISS candidates with the cross-encoder
             
         Returns:
             List of relevant Document objects
         """
+        return self._batcher.submit(query, k, rerank).result()
+    
+    def retrieve_context_batch(self, queries: List[str], k: int = 4, rerank: bool = True,
+                               query_vectors: Optional[np.ndarray] = None) -> List[List[Document]]:
+        """
+        Retrieve relevant documents for several queries at once.
+        
+        All queries are embedded in one pass and searched with a single
+        FAISS call. With reranking, the top candidates of every query are
+        rescored by the cross-encoder in one batched pass.
+        
+        Args:
+            queries: The search queries
+            k: Number of documents to retrieve per query
+            rerank: Whether to rerank FAISS candidates with the cross-encoder
+            query_vectors: Optional precomputed query embeddings, one row per query
+            
+        Returns:
+            One list of relevant Document objects per query
+        """
+        if not queries:
+            return []
+        
         if self.vector_store is None:
             self.load_vector_store()
         
+        use_reranker = rerank and self.reranker is not None
+        fetch_k = max(k, RERANK_FETCH_K) if use_reranker else k
         try:
-            docs = self.vector_store.similarity_search(query, k=k)
-            return docs
+            if query_vectors is None:
+                query_vectors = self.embeddings.embed_documents(queries)
+            vectors = np.array(query_vectors, dtype=np.float32)
+            faiss.normalize_L2(vectors)
+            results = self._search_vectors(vectors, fetch_k)
+            if use_reranker:
+                results = self._rerank(queries, results, k)
+            return results
         except Exception as e:
             print(f"Error retrieving context: {str(e)}")
-            return []
+            return [[] for _ in queries]
+    
+    def _rerank(self, queries: List[str], candidates: List[List[Document]],
+                k: int) -> List[List[Document]]:
+        """Rescore each query's candidates with the cross-encoder and keep the top k."""
+        pairs = [
+            [query, doc.page_content]
+            for query, docs in zip(queries, candidates)
+            for doc in docs
+        ]
+        if not pairs:
+            return candidates
+        scores = np.asarray(self.reranker.predict(pairs, batch_size=RERANK_BATCH_SIZE))
+        
+        reranked = []
+        start = 0
+        for docs in candidates:
+            doc_scores = scores[start:start + len(docs)]
+            start += len(docs)
+            order = np.argsort(-doc_scores, kind="stable")[:k]
+            reranked.append([docs[i] for i in order])
+        return reranked
     
-    def get_context_for_agent(self, query: str, max_length: int = 2000) -> str:
+    def _search_vectors(self, vectors: np.ndarray, k: int) -> List[List[Document]]:
+        """Search the vector store with a batch of query vectors."""
+        if self._emb_matrix is not None:
+            indices = self._search_matrix(vectors, k)
+        else:
+            _, indices = self.vector_store.index.search(vectors, k)
+        docstore = self.vector_store.docstore
+        index_to_id = self.vector_store.index_to_docstore_id
+        
+        results = []
+        for row in indices:
+            docs = [docstore.search(index_to_id[i]) for i in row if i != -1]
+            results.append([doc for doc in docs if isinstance(doc, Document)])
+        return results
+    
+    def _search_matrix(self, vectors: np.ndarray, k: int) -> np.ndarray:
+        """
+        Exact inner-product search over the in-memory embedding matrix.
+        
+        Returns:
+            Row indices of the top k matches per query, best first
+        """
+        scores = vectors @ self._emb_matrix.T
+        k = min(k, scores.shape[1])
+        # argpartition selects the top k in O(N); only those k are sorted
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        return np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+    
+    def get_context_for_agent(self, query: str, max_tokens: int = 500) -> str:
         """
         Get formatted context string for AI agents.
         
         Args:
             query: The search query
-            max_length: Maximum length of context string
+            max_tokens: Maximum number of embedding-model tokens in the context string
             
         Returns:
             Formatted context string
@@ -240,26 +1186,46 @@ Answer: """
         if not docs:
             return "No relevant context found in knowledge base."
         
-        context_parts = []
-        current_length = 0
-        
-        for i, doc in enumerate(docs, 1):
-            doc_text = f"[Source {i}]: {doc.page_content}\n"
-            if current_length + len(doc_text) > max_length:
+        # Check each chunk against the budget before formatting it
+        selected = []
+        total_tokens = 0
+        for doc in docs:
+            # Chunks tokenized at load time carry their token IDs; chunks from
+            # a store saved before that are counted with the same tokenizer
+            token_ids = doc.metadata.get("token_ids")
+            content_tokens = len(token_ids) if token_ids is not None else self._count_tokens(doc.page_content)
+            doc_tokens = content_tokens + self._source_header_tokens
+            if total_tokens + doc_tokens > max_tokens:
                 break
-            context_parts.append(doc_text)
-            current_length += len(doc_text)
+            selected.append(doc.page_content)
+            total_tokens += doc_tokens
         
-        return "\n".join(context_parts)
+        return "\n".join(
+            f"[Source {i}]: {content}\n" for i, content in enumerate(selected, 1)
+        )
 
 
 # Singleton instance
-_rag_instance = None
+_rag_instance: Optional[CarbonFootprintRAG] = None
+
+
+def _lazy_init() -> CarbonFootprintRAG:
+    """Create the RAG system singleton on first use."""
+    global _rag_instance
+    _rag_instance = CarbonFootprintRAG()
+    return _rag_instance
 
 
 def get_rag_system() -> CarbonFootprintRAG:
     """Get or create the RAG system singleton instance."""
-    global _rag_instance
-    if _rag_instance is None:
+    return _rag_instance or _lazy_init()
+
+
+# Build the singleton at import time so servers pay the cost at startup.
+# On failure get_rag_system() retries lazily, where callers handle errors.
+if os.getenv("RAG_EAGER_INIT") == "1":
+    try:
         _rag_instance = CarbonFootprintRAG()
-    return _rag_instance
+    except Exception as e:
+        print(f"Eager RAG initialization failed, deferring to first use: {str(e)}")
+        _rag_instance = None
@@ -4,7 +4,7 @@ Run this once after installing dependencies.
 """
 
 import os
-from rag_system import CarbonFootprintRAG
+from rag_system import get_rag_system
 
 def main():
     print("=" * 60)
@@ -46,7 +46,7 @@ def main():
     
     # Initialize RAG system
     print("Initializing RAG system...")
-    rag = CarbonFootprintRAG()
+    rag = get_rag_system()
     
     # Load documents
     print("Loading documents from knowledge_base/...")